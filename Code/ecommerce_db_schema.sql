@@ -32,7 +32,7 @@ CREATE TABLE IF NOT EXISTS products (
 -- 3. Create the Transactions Table with Foreign Key Constraints and Partitioning
 DROP TABLE IF EXISTS transactions CASCADE;
 CREATE TABLE IF NOT EXISTS transactions (
-    transaction_id SERIAL, -- Auto-incrementing primary key
+    transaction_id BIGINT,             -- Primary key (assigned by the ETL when loading)
     customer_id INT,                   -- FK referencing customer_id in the 'customers' table
     product_id UUID,                   -- FK referencing product_id in the 'products' table
     purchase_date TIMESTAMP,           -- Date and time of the purchase (Partition Key)
@@ -86,7 +86,7 @@ DROP TABLE IF EXISTS discounts CASCADE;
 CREATE TABLE IF NOT EXISTS discounts (
     promo_code_used VARCHAR(50),            -- Promo code used
     discount_applied DECIMAL(5, 2),         -- Discount percentage applied (e.g., 10 for 10%)
-    transaction_id INT,                      -- FK referencing transaction_id in 'transactions'
+    transaction_id BIGINT,                   -- FK referencing transaction_id in 'transactions'
     customer_id INT,                         -- FK referencing customer_id in 'transactions'
     product_id UUID,                         -- FK referencing product_id in 'transactions'
     purchase_date TIMESTAMP,                 -- FK referencing purchase_date in 'transactions'
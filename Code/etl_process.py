@@ -1,7 +1,19 @@
 import os
+import io
+import csv
+import itertools
 import logging
+from logging.handlers import RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import psycopg2
+from pyspark import StorageLevel
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, to_timestamp, regexp_extract, DataFrame
+from pyspark.sql.functions import (
+    col, to_timestamp, regexp_extract, regexp_replace, broadcast, monotonically_increasing_id, DataFrame,
+    lit, coalesce
+)
+from pyspark.sql.types import StructType, StructField, StringType, IntegerType, DoubleType
 
 # Create logs directory if not exists
 LOG_DIR = "/Users/E-commerce Sales Data 2024/E-commerce_venv/logs/"
@@ -11,12 +23,40 @@ if not os.path.exists(LOG_DIR):
 # Configure Logging
 LOG_FILE_PATH = os.path.join(LOG_DIR, "ecommerce_etl.log")
 logging.basicConfig(
-    filename=LOG_FILE_PATH,
+    # Rotate at 10MB, keeping five old files, so the log stays bounded
+    handlers=[RotatingFileHandler(LOG_FILE_PATH, maxBytes=10 * 1024 * 1024, backupCount=5)],
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
 logger = logging.getLogger(__name__)
 
+class CsvRowStream(io.TextIOBase):
+    """Read-only file-like object that renders rows as CSV on demand, for COPY FROM STDIN."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.pending = ""
+        self.line_buffer = io.StringIO()
+        self.writer = csv.writer(self.line_buffer)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        # Only enough rows to satisfy one read are ever held in memory
+        while size < 0 or len(self.pending) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+            self.pending += self.line_buffer.getvalue()
+            self.line_buffer.seek(0)
+            self.line_buffer.truncate()
+        if size < 0:
+            size = len(self.pending)
+        chunk, self.pending = self.pending[:size], self.pending[size:]
+        return chunk
+
 class EcommerceETL:
     def __init__(self, database_url, database_properties, jar_path):
         self.database_url = database_url
@@ -29,6 +69,19 @@ class EcommerceETL:
             spark = SparkSession.builder \
                 .appName("E-commerce ETL") \
                 .config("spark.jars", jar_path) \
+                .config("spark.serializer", "org.apache.spark.serializer.KryoSerializer") \
+                .config("spark.scheduler.mode", "FAIR") \
+                .config("spark.sql.parquet.enableVectorizedReader", "true") \
+                .config("spark.sql.parquet.filterPushdown", "true") \
+                .config("spark.sql.files.maxPartitionBytes", "128MB") \
+                .config("spark.sql.csv.filterPushdown.enabled", "true") \
+                .config("spark.sql.autoBroadcastJoinThreshold", "50MB") \
+                .config("spark.sql.sources.bucketing.enabled", "true") \
+                .config("spark.sql.adaptive.enabled", "true") \
+                .config("spark.sql.adaptive.skewJoin.enabled", "true") \
+                .config("spark.sql.adaptive.coalescePartitions.enabled", "true") \
+                .config("spark.sql.adaptive.advisoryPartitionSizeInBytes", "64m") \
+                .config("spark.sql.adaptive.skewJoin.skewedPartitionFactor", "5") \
                 .getOrCreate()
             logger.info("Spark Session initialized successfully")
             return spark
@@ -36,24 +89,145 @@ class EcommerceETL:
             logger.error(f"Error initializing Spark: {e}")
             raise
 
-    def load_csv(self, file_path):
-        """Loads CSV file into a DataFrame."""
+    def load_csv(self, file_path, schema=None):
+        """Loads CSV file into a DataFrame, skipping schema inference when a schema is given."""
         try:
-            df = self.spark.read.csv(file_path, header=True, inferSchema=True)
+            if schema is not None:
+                df = self.spark.read.csv(file_path, header=True, schema=schema, inferSchema=False, mode="DROPMALFORMED")
+            else:
+                df = self.spark.read.csv(file_path, header=True, inferSchema=True)
             logger.info(f"Loaded CSV: {file_path}")
             return df
         except Exception as e:
             logger.error(f"Error loading CSV {file_path}: {e}")
             raise
 
-    def write_to_postgres(self, df, table_name, mode="append"):
-        """Writes a DataFrame to PostgreSQL."""
+    def load_table(self, file_path, schema=None):
+        """Loads a Parquet or CSV source into a DataFrame based on its extension."""
+        if not file_path.endswith(".parquet"):
+            return self.load_csv(file_path, schema)
+        try:
+            # A known schema lets Spark skip the job that infers it from the file footers
+            reader = self.spark.read if schema is None else self.spark.read.schema(schema)
+            df = reader.parquet(file_path)
+            logger.info(f"Loaded Parquet: {file_path}")
+            return df
+        except Exception as e:
+            logger.error(f"Error loading Parquet {file_path}: {e}")
+            raise
+
+    def load_catalog_table(self, table_name):
+        """Loads a table registered in the Spark catalog, such as one written by bucket_table."""
+        try:
+            df = self.spark.table(table_name)
+            logger.info(f"Loaded catalog table: {table_name}")
+            return df
+        except Exception as e:
+            logger.error(f"Error loading catalog table {table_name}: {e}")
+            raise
+
+    def csv_to_parquet(self, csv_path, parquet_path, schema, num_partitions=4):
+        """Converts a CSV source to Snappy-compressed Parquet."""
         try:
-            df.write.jdbc(self.database_url, table_name, mode=mode, properties=self.database_properties)
+            df = self.load_csv(csv_path, schema)
+            df.repartition(num_partitions).write \
+                .mode("overwrite") \
+                .option("compression", "snappy") \
+                .parquet(parquet_path)
+            logger.info(f"Converted CSV {csv_path} to Parquet: {parquet_path}")
+        except Exception as e:
+            logger.error(f"Error converting CSV {csv_path} to Parquet: {e}")
+            raise
+
+    def bucket_table(self, df, table_name, bucket_column, path, num_buckets=64):
+        """Writes a DataFrame as Parquet bucketed and sorted by bucket_column, registered as table_name."""
+        try:
+            # Hash rows into one task per bucket so each bucket is a single file,
+            # not one file per input partition and bucket
+            df.repartition(num_buckets, col(bucket_column)).write \
+                .mode("overwrite") \
+                .bucketBy(num_buckets, bucket_column) \
+                .sortBy(bucket_column) \
+                .option("path", path) \
+                .saveAsTable(table_name)
+            logger.info(f"Bucketed {table_name} by {bucket_column} into {num_buckets} buckets: {path}")
+        except Exception as e:
+            logger.error(f"Error bucketing {table_name}: {e}")
+            raise
+
+    def register_bucketed_table(self, table_name, path, schema, bucket_column, num_buckets=64):
+        """Re-registers bucketed Parquet files written by bucket_table in a new session."""
+        # The bucket spec lives in the catalog, not in the files, so it is restated here
+        columns = ", ".join(f"`{field.name}` {field.dataType.simpleString()}" for field in schema.fields)
+        try:
+            self.spark.sql(
+                f"CREATE TABLE IF NOT EXISTS {table_name} ({columns}) USING parquet "
+                f"CLUSTERED BY (`{bucket_column}`) SORTED BY (`{bucket_column}`) INTO {num_buckets} BUCKETS "
+                f"LOCATION '{path}'"
+            )
+            logger.info(f"Registered bucketed table {table_name}: {path}")
+        except Exception as e:
+            logger.error(f"Error registering bucketed table {table_name}: {e}")
+            raise
+
+    def write_to_postgres(self, df, table_name, mode="append", num_writers=8):
+        """Writes a DataFrame to PostgreSQL using at most num_writers parallel connections."""
+        try:
+            # Coalesce first so the database sees bounded concurrency instead of one
+            # session per shuffle partition
+            df.coalesce(num_writers).write \
+                .option("numPartitions", num_writers) \
+                .jdbc(self.database_url, table_name, mode=mode, properties=self.database_properties)
             logger.info(f"Successfully written to PostgreSQL: {table_name}")
         except Exception as e:
             logger.error(f"Error writing to PostgreSQL {table_name}: {e}")
 
+    def write_in_pool(self, writer, df, table_name):
+        """Runs a table write in its own FAIR scheduler pool so concurrent writes share executor cores."""
+        # Jobs without a pool all land in the FIFO "default" pool, even in FAIR mode
+        spark_context = self.spark.sparkContext
+        spark_context.setLocalProperty("spark.scheduler.pool", table_name)
+        try:
+            writer(df, table_name)
+        finally:
+            spark_context.setLocalProperty("spark.scheduler.pool", None)
+
+    def postgres_connection_params(self):
+        """Builds psycopg2 connection parameters from the JDBC URL and properties."""
+        url = urlparse(self.database_url[len("jdbc:"):])
+        return {
+            "host": url.hostname,
+            "port": url.port or 5432,
+            "dbname": url.path.lstrip("/"),
+            "user": self.database_properties["user"],
+            "password": self.database_properties["password"]
+        }
+
+    def copy_to_postgres(self, df, table_name, num_writers=8):
+        """Bulk-loads a DataFrame into PostgreSQL with COPY FROM STDIN, one connection per partition."""
+        try:
+            # Only plain values go into the closure; it is shipped to the executors
+            connection_params = self.postgres_connection_params()
+            columns = ", ".join(f'"{name}"' for name in df.columns)
+            copy_sql = f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)"
+
+            def copy_partition(rows):
+                # Rows are streamed into COPY in small chunks rather than buffered per partition
+                first_row = next(rows, None)
+                if first_row is None:
+                    return
+                connection = psycopg2.connect(**connection_params)
+                try:
+                    with connection, connection.cursor() as cursor:
+                        cursor.copy_expert(copy_sql, CsvRowStream(itertools.chain([first_row], rows)))
+                finally:
+                    connection.close()
+
+            df.coalesce(num_writers).foreachPartition(copy_partition)
+            logger.info(f"Successfully copied to PostgreSQL: {table_name}")
+        except Exception as e:
+            logger.error(f"Error copying to PostgreSQL {table_name}: {e}")
+
     def read_from_postgres(self,table_name):
         """Read data from a PostgreSQL table and return a Spark DataFrame."""
         try:
@@ -64,6 +238,12 @@ class EcommerceETL:
             logger.error(f"Error reading from PostgreSQL {table_name}: {e}")
             return None  # Return None if reading fails
         
+    def log_preview(self, df, name, num_rows=5):
+        """Logs the first rows of a DataFrame, only when DEBUG logging is enabled."""
+        if logger.isEnabledFor(logging.DEBUG):
+            rows = df.take(num_rows)
+            logger.debug(f"Preview of {name}: {rows}")
+
     def transform_customers(self, df):
     #Transforms the Customers DataFrame while keeping all original columns."""
         """Transforms the Customers DataFrame."""
@@ -89,34 +269,47 @@ class EcommerceETL:
             col("Color").alias("color"),
             col("Dimensions").alias("dimensions"),
             col("Shipping Weight").alias("shipping_weight").cast("decimal(10,2)"),
-            regexp_extract(col("Selling Price"), r"\$([\d,]+\.?\d*)", 1).alias("selling_price").cast("decimal(10,2)"),
+            # Strip thousands separators so "$1,299.00" casts instead of becoming NULL
+            regexp_replace(regexp_extract(col("Selling Price"), r"\$([\d,]+\.?\d*)", 1), ",", "")
+                .cast("decimal(10,2)").alias("selling_price"),
             col("Stock").alias("stock").cast("int"),
             col("Quantity").alias("quantity").cast("int"),
             col("Product URL").alias("product_url"),
             col("Product Description").alias("product_description")
         )
     
-    def transform_transactions(self, transactions_df, customers_df):
+    def transform_transactions(self, transactions_df, customers_df, broadcast_customers=True):
         """Transforms transactions and customers, then joins them into a final DataFrame."""
 
-        return transactions_df.withColumn("purchase_date", to_timestamp(col("Time stamp"), "dd/MM/yyyy H:mm")) \
+        # Drop malformed timestamps before the (comparatively expensive) to_timestamp parse. The
+        # regex itself runs in Spark; only the implied IS NOT NULL reaches the reader.
+        transactions_df = transactions_df.where(col("Time stamp").rlike(TIMESTAMP_PATTERN)) \
+            .withColumn("purchase_date", to_timestamp(col("Time stamp"), "dd/MM/yyyy H:mm")) \
             .select(
                 col("user id").alias("customer_id").cast("int"),
                 col("product id").alias("product_id").cast("string"),
                 col("purchase_date")
-            ).dropna(subset=["purchase_date"]) \
-            .join(
-                customers_df.select(
-                    col("Customer ID").alias("customer_id").cast("int"),
-                    col("Purchase Amount (USD)").alias("purchase_amount_usd").cast("decimal(10,2)"),
-                    col("Shipping Type").alias("shipping_type"),
-                    col("Discount Applied").alias("discount_applied").cast("decimal(5,2)"),
-                    col("Promo Code Used").alias("promo_code_used"),
-                    col("Payment Method").alias("payment_method")
-                ),
-                on="customer_id",
-                how="left"
-            )
+            ).dropna(subset=["purchase_date"])
+
+        customers_df = customers_df.select(
+            col("Customer ID").alias("customer_id").cast("int"),
+            col("Purchase Amount (USD)").alias("purchase_amount_usd").cast("decimal(10,2)"),
+            col("Shipping Type").alias("shipping_type"),
+            col("Discount Applied").alias("discount_applied").cast("decimal(5,2)"),
+            col("Promo Code Used").alias("promo_code_used"),
+            col("Payment Method").alias("payment_method")
+        )
+
+        # Customers is small; broadcast it to avoid shuffling transactions.
+        # Co-bucketed inputs skip the hint and get a shuffle-free sort-merge join.
+        if broadcast_customers:
+            customers_df = broadcast(customers_df)
+
+        return transactions_df.join(
+            customers_df,
+            on="customer_id",
+            how="left"
+        )
 
     def transform_interactions(self, transactions_df):
         """Creates Interactions Table."""
@@ -132,82 +325,115 @@ class EcommerceETL:
         if transactions_df is None:
             raise ValueError("transactions_df is None. Check if the table was read correctly.")
 
-        return transactions_df.select(
+        return transactions_df.where(col("promo_code_used").isNotNull()).select(
             col("transaction_id"),
             col("promo_code_used"),
             col("discount_applied").cast("decimal(5,2)"),
             col("customer_id").cast("int"),
             col("product_id").cast("string"),
             col("purchase_date").cast("timestamp")
-        ).where(col("promo_code_used").isNotNull())
+        )
 
     def transform_product_categories(self, products_df):
         """Creates Product Categories Table."""
         return products_df.select(
             col("product_id").alias("category_id").cast('string'),
             col("category").alias("category_name")
-        ).distinct()
+        ).dropDuplicates(["category_id", "category_name"])
     
     def transform_product_variants(self, products_df):
         """Creates Product Variants Table with cleaned data."""
 
+        # Fill NULL values with defaults inside the projection itself
         product_variants_df = products_df.select(
             col("product_id").cast("string"),
-            col("size"),
-            col("color"),
-            col("quantity").alias("stock_quantity").cast("int")
+            coalesce(col("size"), lit("Unknown")).alias("size"),
+            coalesce(col("color"), lit("Unknown")).alias("color"),
+            coalesce(col("quantity").cast("int"), lit(0)).alias("stock_quantity")
         )
 
-        # Fill NULL values with defaults
-        product_variants_df = product_variants_df.fillna({
-            "size": "Unknown", 
-            "color": "Unknown", 
-            "stock_quantity": 0
-        })
-
         # Remove duplicates
-        product_variants_df = product_variants_df.distinct()
-
-        # Print summary for debugging
-        product_variants_df.select(["size", "color", "stock_quantity"]).summary("count", "min", "max").show()
+        product_variants_df = product_variants_df.dropDuplicates(["product_id", "size", "color", "stock_quantity"])
 
         return product_variants_df
 
 
-    def run_etl(self, customer_path, product_path, transaction_path):
-        """Executes the full ETL pipeline."""
+    def run_etl(self, customer_path, product_path, transaction_path, bucketed=False):
+        """Executes the full ETL pipeline.
+
+        With bucketed=True, customer_path and transaction_path name catalog tables bucketed by customer ID.
+        """
         try:
             logger.info("Starting ETL Process...")
 
             # Load Data
-            customers_df = self.load_csv(customer_path)
-            products_df = self.load_csv(product_path)
-            transactions_df = self.load_csv(transaction_path)
+            if bucketed:
+                customers_df = self.load_catalog_table(customer_path)
+                transactions_df = self.load_catalog_table(transaction_path)
+            else:
+                customers_df = self.load_table(customer_path, CUSTOMER_SCHEMA)
+                transactions_df = self.load_table(transaction_path, TRANSACTION_SCHEMA)
+            # Customers feeds two transforms; cache it instead of re-reading the source
+            customers_df = customers_df.persist(StorageLevel.MEMORY_ONLY)
+            products_df = self.load_table(product_path, PRODUCT_SCHEMA)
 
             # Transform Data
             customers_transform_df = self.transform_customers(customers_df)
-            products_transform_df = self.transform_products(products_df)
-            transactions_transform_df = self.transform_transactions(transactions_df, customers_df)
+            products_transform_df = self.transform_products(products_df).persist(StorageLevel.MEMORY_ONLY)
+            # Assign transaction IDs up front so discounts can reference them without
+            # reading the transactions table back from PostgreSQL. This one DataFrame
+            # carries every column needed by the transactions, interactions and discounts
+            # tables, which are derived from it as narrow views.
+            if bucketed:
+                # Join on the existing bucket layout rather than broadcasting customers
+                transactions_joined_df = self.transform_transactions(
+                    transactions_df, customers_df, broadcast_customers=False
+                )
+            else:
+                transactions_joined_df = self.transform_transactions(transactions_df, customers_df)
+            # monotonically_increasing_id() depends on row order, which a shuffled join
+            # does not guarantee, so a recompute could hand out different IDs and break the
+            # discounts -> transactions foreign key. localCheckpoint() materialises the IDs
+            # once in executor storage (memory and disk) and cuts the lineage, so later
+            # reads never recompute them.
+            transactions_full_df = transactions_joined_df \
+                .withColumn("transaction_id", monotonically_increasing_id()) \
+                .localCheckpoint()
             
-            customers_transform_df.show(5)
-            products_transform_df.show(5)
-            transactions_transform_df.show(5)
+            self.log_preview(customers_transform_df, "customers")
+            self.log_preview(products_transform_df, "products")
+            self.log_preview(transactions_full_df, "transactions")
 
-            interactions_df = self.transform_interactions(transactions_transform_df)
-            read_from_transactions_df = self.read_from_postgres("transactions")
-            discounts_df = self.transform_discounts(read_from_transactions_df)
+            interactions_df = self.transform_interactions(transactions_full_df)
+            discounts_df = self.transform_discounts(transactions_full_df)
             product_categories_df = self.transform_product_categories(products_transform_df)
             product_variants_df = self.transform_product_variants(products_transform_df)
 
-            # Write to PostgreSQL
-            self.write_to_postgres(customers_transform_df, "customers")
-            self.write_to_postgres(products_transform_df, "products")
-            self.write_to_postgres(transactions_transform_df, "transactions")
-            self.write_to_postgres(interactions_df, "interactions")
-            self.write_to_postgres(discounts_df, "discounts")
-            self.write_to_postgres(product_categories_df, "product_categories")
-            self.write_to_postgres(product_variants_df, "product_variants")
-            
+            # Write to PostgreSQL: stages run in foreign-key order, and the
+            # independent tables within a stage are written concurrently.
+            # The two largest tables are bulk-loaded with COPY instead of JDBC.
+            write_stages = [
+                [(self.write_to_postgres, customers_transform_df, "customers"),
+                 (self.write_to_postgres, products_transform_df, "products"),
+                 (self.write_to_postgres, product_categories_df, "product_categories")],
+                [(self.copy_to_postgres, transactions_full_df, "transactions"),
+                 (self.copy_to_postgres, interactions_df, "interactions"),
+                 (self.write_to_postgres, product_variants_df, "product_variants")],
+                [(self.write_to_postgres, discounts_df, "discounts")]
+            ]
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                for stage in write_stages:
+                    futures = [
+                        executor.submit(self.write_in_pool, writer, df, table_name)
+                        for writer, df, table_name in stage
+                    ]
+                    for future in futures:
+                        future.result()
+
+            # Release cached blocks before the session stops
+            customers_df.unpersist()
+            products_transform_df.unpersist()
+
             logger.info("ETL Process Completed Successfully")
 
         except Exception as e:
@@ -217,22 +443,133 @@ class EcommerceETL:
             logger.info("Spark Session Stopped")
 
 
+# Format of the "Time stamp" column in the sales data (dd/MM/yyyy H:mm), e.g. 10/10/2023 8:00
+TIMESTAMP_PATTERN = r"^\d{2}/\d{2}/\d{4} \d{1,2}:\d{2}$"
+
 # Database Configuration
 DATABASE_URL = "jdbc:postgresql://localhost:5432/ecommerce_db"
 DATABASE_PROPERTIES = {
     "user": "postgres",
     "password": "postgres",
     "driver": "org.postgresql.Driver",
-    "stringtype": "unspecified"
+    "stringtype": "unspecified",
+    "reWriteBatchedInserts": "true",  # Driver folds batched INSERTs into multi-row statements
+    "batchsize": "10000",
+    "isolationLevel": "NONE"
 }
 JAR_PATH = "/Users/E-commerce Sales Data 2024/E-commerce_venv/postgresql-42.5.1.jar"
 
+# Source Schemas (column order must match the CSV headers)
+CUSTOMER_SCHEMA = StructType([
+    StructField("Customer ID", IntegerType()),
+    StructField("Age", IntegerType()),
+    StructField("Gender", StringType()),
+    StructField("Item Purchased", StringType()),
+    StructField("Category", StringType()),
+    StructField("Purchase Amount (USD)", IntegerType()),
+    StructField("Location", StringType()),
+    StructField("Size", StringType()),
+    StructField("Color", StringType()),
+    StructField("Season", StringType()),
+    StructField("Review Rating", DoubleType()),
+    StructField("Subscription Status", StringType()),
+    StructField("Shipping Type", StringType()),
+    StructField("Discount Applied", StringType()),
+    StructField("Promo Code Used", StringType()),
+    StructField("Previous Purchases", IntegerType()),
+    StructField("Payment Method", StringType()),
+    StructField("Frequency of Purchases", StringType())
+])
+PRODUCT_SCHEMA = StructType([
+    StructField("Uniqe Id", StringType()),
+    StructField("Product Name", StringType()),
+    StructField("Brand Name", StringType()),
+    StructField("Asin", StringType()),
+    StructField("Category", StringType()),
+    StructField("Upc Ean Code", StringType()),
+    StructField("List Price", StringType()),
+    StructField("Selling Price", StringType()),
+    StructField("Quantity", IntegerType()),
+    StructField("Model Number", StringType()),
+    StructField("About Product", StringType()),
+    StructField("Product Specification", StringType()),
+    StructField("Technical Details", StringType()),
+    StructField("Shipping Weight", StringType()),
+    StructField("Product Dimensions", StringType()),
+    StructField("Image", StringType()),
+    StructField("Variants", StringType()),
+    StructField("Sku", StringType()),
+    StructField("Product Url", StringType()),
+    StructField("Stock", IntegerType()),
+    StructField("Product Details", StringType()),
+    StructField("Dimensions", StringType()),
+    StructField("Color", StringType()),
+    StructField("Ingredients", StringType()),
+    StructField("Direction To Use", StringType()),
+    StructField("Is Amazon Seller", StringType()),
+    StructField("Size Quantity Variant", StringType()),
+    StructField("Product Description", StringType())
+])
+TRANSACTION_SCHEMA = StructType([
+    StructField("user id", IntegerType()),
+    StructField("product id", StringType()),
+    StructField("Interaction type", StringType()),
+    StructField("Time stamp", StringType()),
+    StructField("_c4", StringType())  # Trailing empty column in the source header
+])
+
 # File Paths
-CUSTOMER_PATH = "/Users/E-commerce Sales Data 2024/E-commerce_venv/Data/customer_details.csv"
-PRODUCT_PATH = "/Users/E-commerce Sales Data 2024/E-commerce_venv/Data/product_details.csv"
-TRANSACTION_PATH = "/Users/E-commerce Sales Data 2024/E-commerce_venv/Data/E-commerece_sales_data_2023.csv"
+DATA_DIR = "/Users/E-commerce Sales Data 2024/E-commerce_venv/Data/"
+CUSTOMER_CSV_PATH = os.path.join(DATA_DIR, "customer_details.csv")
+PRODUCT_CSV_PATH = os.path.join(DATA_DIR, "product_details.csv")
+TRANSACTION_CSV_PATH = os.path.join(DATA_DIR, "E-commerece_sales_data_2023.csv")
+
+# Parquet copies of the CSV sources, regenerated by csv_to_parquet whenever the CSV changes
+CUSTOMER_PATH = os.path.join(DATA_DIR, "parquet", "customer_details.parquet")
+PRODUCT_PATH = os.path.join(DATA_DIR, "parquet", "product_details.parquet")
+TRANSACTION_PATH = os.path.join(DATA_DIR, "parquet", "E-commerece_sales_data_2023.parquet")
+
+# Bucketed copies of customers and transactions, keyed on customer ID. Enable once
+# customers is too large to broadcast, so repeated runs join without a shuffle.
+BUCKETED_INPUTS = False
+BUCKETED_DIR = os.path.join(DATA_DIR, "bucketed")
+CUSTOMER_TABLE = "customers_bucketed"
+TRANSACTION_TABLE = "transactions_bucketed"
+
+def needs_refresh(source_path, output_path):
+    """Returns True when a Spark output directory is missing or older than its source file or directory."""
+    # Spark writes _SUCCESS last, so its mtime marks when an output directory was completed
+    if os.path.isdir(source_path):
+        source_path = os.path.join(source_path, "_SUCCESS")
+    marker_path = os.path.join(output_path, "_SUCCESS")
+    return not os.path.exists(marker_path) or os.path.getmtime(source_path) > os.path.getmtime(marker_path)
 
 # Run ETL
 if __name__ == "__main__":
     etl = EcommerceETL(DATABASE_URL, DATABASE_PROPERTIES, JAR_PATH)
-    etl.run_etl(CUSTOMER_PATH, PRODUCT_PATH, TRANSACTION_PATH)
+
+    # Convert the CSV sources to Parquet when first run or after a CSV has been edited
+    for csv_path, parquet_path, schema in [
+        (CUSTOMER_CSV_PATH, CUSTOMER_PATH, CUSTOMER_SCHEMA),
+        (PRODUCT_CSV_PATH, PRODUCT_PATH, PRODUCT_SCHEMA),
+        (TRANSACTION_CSV_PATH, TRANSACTION_PATH, TRANSACTION_SCHEMA),
+    ]:
+        if needs_refresh(csv_path, parquet_path):
+            etl.csv_to_parquet(csv_path, parquet_path, schema)
+
+    if BUCKETED_INPUTS:
+        # Rebuild the bucketed copies when their Parquet source is newer; otherwise
+        # only re-register the existing files in this session's catalog
+        for table_name, parquet_path, schema, bucket_column in [
+            (CUSTOMER_TABLE, CUSTOMER_PATH, CUSTOMER_SCHEMA, "Customer ID"),
+            (TRANSACTION_TABLE, TRANSACTION_PATH, TRANSACTION_SCHEMA, "user id"),
+        ]:
+            bucketed_path = os.path.join(BUCKETED_DIR, table_name)
+            if needs_refresh(parquet_path, bucketed_path):
+                etl.bucket_table(etl.load_table(parquet_path, schema), table_name, bucket_column, bucketed_path)
+            else:
+                etl.register_bucketed_table(table_name, bucketed_path, schema, bucket_column)
+
+        etl.run_etl(CUSTOMER_TABLE, PRODUCT_PATH, TRANSACTION_TABLE, bucketed=True)
+    else:
+        etl.run_etl(CUSTOMER_PATH, PRODUCT_PATH, TRANSACTION_PATH)